@@ -0,0 +1,14 @@
+-- Миграция: Индексы для просмотра лобби в Telegram боте
+-- Выполните этот скрипт в Supabase SQL Editor ПОСЛЕ выполнения supabase-migration-battleship.sql
+
+-- 1. Индекс для постраничного просмотра открытых игр (keyset-пагинация по created_at, id)
+CREATE INDEX IF NOT EXISTS idx_games_lobby
+ON games(created_at DESC, id DESC)
+WHERE status = 'WAITING';
+
+-- 2. Индекс для просмотра открытых игр с фильтром по режиму (NUMBERS, WORDS, BATTLESHIP)
+CREATE INDEX IF NOT EXISTS idx_games_lobby_mode
+ON games(game_mode, created_at DESC, id DESC)
+WHERE status = 'WAITING';
+
+-- Готово! Бот может листать lobby_games без OFFSET
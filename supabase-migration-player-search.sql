@@ -0,0 +1,14 @@
+-- Миграция: Индексы для поиска игроков по логину (inline-режим Telegram бота)
+-- Выполните этот скрипт в Supabase SQL Editor ПОСЛЕ выполнения supabase-migration-invitations.sql
+
+-- 1. Включить расширение pg_trgm (trigram-индексы для ILIKE)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- 2. Trigram-индексы для поиска по началу логина и Telegram username без учета регистра
+CREATE INDEX IF NOT EXISTS idx_players_login_trgm
+ON players USING GIN (login gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_players_telegram_username_trgm
+ON players USING GIN (telegram_username gin_trgm_ops);
+
+-- Готово! Запросы вида login ILIKE 'abc%' используют индекс даже на большой таблице players
@@ -5,20 +5,39 @@ Telegram бот для игры "Быки и Коровы"
 """
 
 import os
+import re
+import math
+import asyncio
+import html
+import time
+import uuid
 from dotenv import load_dotenv
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from typing import Optional
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    WebAppInfo,
+)
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes,
+    InlineQueryHandler,
     MessageHandler,
     filters,
 )
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
+
+from db_guard import DB_CLIENT_TIMEOUT, DB_WRITE_CLIENT_TIMEOUT, DatabaseUnavailable, db_execute
+from profiling import PROFILE_DURATION, TimedRequest, profiler
 
 # Настройка логирования
 logging.basicConfig(
@@ -35,6 +54,10 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEBAPP_URL = os.getenv("WEBAPP_URL")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Сколько обновлений обрабатывается одновременно
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+# Telegram ID администраторов через запятую (команды /profile и /slow)
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip()}
 
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN не задан в переменных окружения (.env)")
@@ -44,7 +67,52 @@ if not SUPABASE_URL or not SUPABASE_KEY:
     logger.warning("SUPABASE_URL/SUPABASE_KEY не заданы — функции БД будут недоступны")
 
 # Инициализация Supabase клиента
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    options=ClientOptions(postgrest_client_timeout=DB_CLIENT_TIMEOUT)
+) if SUPABASE_URL and SUPABASE_KEY else None
+
+# Отдельный клиент для записи: его таймаут ограничивает запись в DB_WRITE_TIMEOUT
+supabase_write: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    options=ClientOptions(postgrest_client_timeout=DB_WRITE_CLIENT_TIMEOUT)
+) if SUPABASE_URL and SUPABASE_KEY else None
+
+DB_UNAVAILABLE_TEXT = "⏳ База данных временно недоступна, попробуйте позже"
+STALE_NOTICE = "\n⚠️ <i>База данных недоступна, показаны сохраненные данные</i>"
+
+# Лобби: размер страницы и время жизни общего кэша страниц (секунды)
+LOBBY_PAGE_SIZE = int(os.getenv("LOBBY_PAGE_SIZE", "8"))
+LOBBY_CACHE_TTL = float(os.getenv("LOBBY_CACHE_TTL", "5"))
+
+LOBBY_MODES = {
+    'NUMBERS': '🔢 Цифры',
+    'WORDS': '📝 Слова',
+    'BATTLESHIP': '🚢 Морской бой',
+}
+
+# Кэш страниц лобби: (game_mode, cursor) -> (время загрузки, строки).
+# Общий для всех пользователей, поэтому за LOBBY_CACHE_TTL на каждую
+# страницу уходит не более одного запроса к БД.
+lobby_cache: dict = {}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Выполняющиеся загрузки для кэшей лобби и поиска: ключ -> asyncio.Task
+inflight: dict = {}
+
+# Inline-поиск игроков: число результатов, время жизни кэша префиксов (секунды)
+# и cache_time ответа на стороне Telegram (секунды)
+SEARCH_RESULTS_LIMIT = int(os.getenv("SEARCH_RESULTS_LIMIT", "20"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "30"))
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "10"))
+
+# Кэш поиска: префикс -> (время загрузки, строки, загружены ли все совпадения).
+# Если для более короткого префикса загружены все совпадения,
+# более длинный префикс фильтруется локально без запроса к БД.
+search_cache: dict = {}
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -55,11 +123,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if supabase:
         try:
             # Проверяем, существует ли пользователь
-            result = supabase.table('players').select('*').eq('telegram_id', user.id).execute()
+            result = await db_execute(
+                supabase.table('players').select('*').eq('telegram_id', user.id)
+            )
 
             if not result.data:
                 # Создаем нового пользователя
-                supabase.table('players').insert({
+                await db_execute(supabase_write.table('players').insert({
                     'telegram_id': user.id,
                     'telegram_username': user.username,
                     'telegram_first_name': user.first_name,
@@ -68,17 +138,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                     'nickname': user.first_name or user.username or f"Игрок {user.id}",
                     'avatar': '○',
                     'is_online': True,
-                }).execute()
+                }), 'write')
                 logger.info(f"Создан новый пользователь: {user.id}")
             else:
                 # Обновляем данные существующего пользователя
-                supabase.table('players').update({
+                await db_execute(supabase_write.table('players').update({
                     'telegram_username': user.username,
                     'telegram_first_name': user.first_name,
                     'telegram_last_name': user.last_name,
                     'is_online': True,
                     'last_seen': datetime.now().isoformat(),
-                }).eq('telegram_id', user.id).execute()
+                }).eq('telegram_id', user.id), 'write')
                 logger.info(f"Обновлен пользователь: {user.id}")
         except Exception as e:
             logger.error(f"Ошибка при работе с БД: {e}")
@@ -87,6 +157,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     keyboard = [
         [InlineKeyboardButton("🎮 Играть", web_app=WebAppInfo(url=WEBAPP_URL))],
         [InlineKeyboardButton("👥 Участники", callback_data='participants')],
+        [InlineKeyboardButton("🎲 Открытые игры", callback_data='lobby')],
         [InlineKeyboardButton("📨 Мои приглашения", callback_data='my_invitations')],
         [InlineKeyboardButton("ℹ️ Помощь", callback_data='help')],
     ]
@@ -102,6 +173,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 Что умеет этот бот:
 • 🎮 Запуск игры
 • 👥 Просмотр онлайн участников
+• 🎲 Просмотр открытых игр
 • 📨 Приглашения других игроков
 • 🔔 Уведомления о приглашениях
 
@@ -126,12 +198,14 @@ async def participants(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     try:
         # Получаем онлайн игроков
-        result = supabase.table('players')\
-            .select('id, login, telegram_username, telegram_first_name, is_online')\
-            .eq('is_online', True)\
-            .order('last_seen', desc=True)\
-            .limit(50)\
-            .execute()
+        result = await db_execute(
+            supabase.table('players')
+            .select('id, login, telegram_username, telegram_first_name, is_online')
+            .eq('is_online', True)
+            .order('last_seen', desc=True)
+            .limit(50),
+            fallback_key='participants'
+        )
 
         if not result.data:
             await query.message.reply_text("Нет онлайн участников")
@@ -157,6 +231,9 @@ async def participants(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                     )
                 )
 
+        if result.stale:
+            text += STALE_NOTICE
+
         # Группируем кнопки по 2 в ряд
         keyboard_rows = [keyboard[i:i+2] for i in range(0, len(keyboard), 2)]
         keyboard_rows.append([InlineKeyboardButton("◀️ Назад", callback_data='back_to_menu')])
@@ -168,6 +245,9 @@ async def participants(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             reply_markup=reply_markup,
             parse_mode='HTML'
         )
+    except DatabaseUnavailable as e:
+        logger.warning(f"БД недоступна при получении участников: {e}")
+        await query.message.reply_text(DB_UNAVAILABLE_TEXT)
     except Exception as e:
         logger.error(f"Ошибка при получении участников: {e}")
         await query.message.reply_text("❌ Ошибка при загрузке участников")
@@ -185,11 +265,13 @@ async def my_invitations(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     try:
         # Получаем player_id по telegram_id
-        player_result = supabase.table('players')\
-            .select('id')\
-            .eq('telegram_id', user.id)\
-            .single()\
-            .execute()
+        player_result = await db_execute(
+            supabase.table('players')
+            .select('id')
+            .eq('telegram_id', user.id)
+            .single(),
+            fallback_key=('player_id', user.id)
+        )
 
         if not player_result.data:
             await query.message.reply_text("❌ Пользователь не найден")
@@ -198,7 +280,10 @@ async def my_invitations(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         player_id = player_result.data['id']
 
         # Получаем приглашения
-        result = supabase.rpc('get_player_invitations', {'player_id': player_id}).execute()
+        result = await db_execute(
+            supabase.rpc('get_player_invitations', {'player_id': player_id}),
+            fallback_key=('invitations', player_id)
+        )
 
         if not result.data:
             await query.message.reply_text(
@@ -230,6 +315,9 @@ async def my_invitations(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 )
             ])
 
+        if result.stale:
+            text += STALE_NOTICE
+
         keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data='back_to_menu')])
         reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -238,11 +326,352 @@ async def my_invitations(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             reply_markup=reply_markup,
             parse_mode='HTML'
         )
+    except DatabaseUnavailable as e:
+        logger.warning(f"БД недоступна при получении приглашений: {e}")
+        await query.message.reply_text(DB_UNAVAILABLE_TEXT)
     except Exception as e:
         logger.error(f"Ошибка при получении приглашений: {e}")
         await query.message.reply_text("❌ Ошибка при загрузке приглашений")
 
 
+async def single_flight(key, load):
+    """
+    Выполнить load() один раз для всех одновременных вызовов с ключом key
+
+    Пока загрузка идет, остальные вызовы ждут ее результат (или исключение),
+    поэтому при истечении кэша на ключ уходит один запрос к БД.
+    """
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(load())
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    # shield: отмена одного из ожидающих не отменяет загрузку для остальных
+    return await asyncio.shield(task)
+
+
+def to_base36(number: int) -> str:
+    """Записать неотрицательное число в base36"""
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    result = ''
+    while True:
+        number, rem = divmod(number, 36)
+        result = digits[rem] + result
+        if not number:
+            return result
+
+
+def encode_lobby_cursor(game: dict) -> str:
+    """
+    Курсор следующей страницы лобби по последней игре текущей
+
+    callback_data ограничен 64 байтами, поэтому created_at кодируется как
+    микросекунды от эпохи в base36, а id — как hex без дефисов.
+    """
+    # PostgREST отдает дробную часть секунд без завершающих нулей,
+    # а fromisoformat до Python 3.11 понимает только 3 или 6 знаков
+    match = re.match(r'(.*T\d\d:\d\d:\d\d)(?:\.(\d+))?(.*)$', game['created_at'].replace('Z', '+00:00'))
+    base, fraction, tz = match.groups()
+    created_at = datetime.fromisoformat(f"{base}.{(fraction or '0')[:6].ljust(6, '0')}{tz}")
+
+    micros = (created_at - EPOCH) // timedelta(microseconds=1)
+    return f"{to_base36(micros)}_{uuid.UUID(game['id']).hex}"
+
+
+def decode_lobby_cursor(cursor: str) -> tuple:
+    """Разобрать курсор лобби в (created_at в ISO, id)"""
+    micros, game_id = cursor.split('_')
+    created_at = EPOCH + timedelta(microseconds=int(micros, 36))
+    # UTC с суффиксом Z: без '+', который пришлось бы экранировать в фильтре
+    return created_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ'), str(uuid.UUID(game_id))
+
+
+async def fetch_lobby_page(game_mode: Optional[str], cursor: Optional[str]) -> tuple:
+    """
+    Загрузить страницу открытых игр из lobby_games
+
+    Используется keyset-пагинация по (created_at, id): следующая страница
+    начинается строго после последней игры предыдущей, даже если у игр
+    совпадает created_at. Запрашивается
+    на одну запись больше LOBBY_PAGE_SIZE, чтобы понять, есть ли продолжение.
+
+    Args:
+        game_mode: режим игры (NUMBERS, WORDS, BATTLESHIP) или None для всех
+        cursor: курсор из encode_lobby_cursor для последней игры предыдущей страницы или None
+
+    Returns:
+        Список игр (не более LOBBY_PAGE_SIZE + 1) и признак сохраненных данных
+    """
+    key = (game_mode, cursor)
+    now = time.monotonic()
+
+    cached = lobby_cache.get(key)
+    if cached and now - cached[0] < LOBBY_CACHE_TTL:
+        return cached[1], False
+
+    # Одновременные промахи по одной странице ждут один и тот же запрос
+    async def load() -> tuple:
+        query = supabase.table('lobby_games')\
+            .select('id, game_mode, game_name, prize, creator_login, creator_nickname, created_at')
+
+        if game_mode:
+            query = query.eq('game_mode', game_mode)
+        if cursor:
+            created_at, game_id = decode_lobby_cursor(cursor)
+            query = query.or_(f"created_at.lt.{created_at},and(created_at.eq.{created_at},id.lt.{game_id})")
+
+        result = await db_execute(
+            query
+            .order('created_at', desc=True)
+            .order('id', desc=True)
+            .limit(LOBBY_PAGE_SIZE + 1),
+            fallback_key=('lobby', game_mode, cursor)
+        )
+        rows = result.data or []
+        if result.stale:
+            return rows, True
+
+        now = time.monotonic()
+
+        # Удаляем устаревшие страницы, чтобы кэш не рос бесконечно
+        for stale_key in [k for k, (loaded_at, _) in lobby_cache.items() if now - loaded_at >= LOBBY_CACHE_TTL]:
+            del lobby_cache[stale_key]
+
+        lobby_cache[key] = (now, rows)
+        return rows, False
+
+    return await single_flight(('lobby', key), load)
+
+
+async def build_lobby_page(game_mode: Optional[str], cursor: Optional[str]) -> tuple:
+    """Сформировать текст и клавиатуру страницы лобби"""
+    rows, stale = await fetch_lobby_page(game_mode, cursor)
+    games = rows[:LOBBY_PAGE_SIZE]
+    has_next = len(rows) > LOBBY_PAGE_SIZE
+    mode_key = game_mode or 'ALL'
+
+    text = f"🎲 <b>Открытые игры</b> ({LOBBY_MODES.get(game_mode, 'все режимы')})\n\n"
+    keyboard = []
+
+    if not games:
+        text += "Больше игр нет" if cursor else "Нет открытых игр"
+
+    for idx, game in enumerate(games, 1):
+        game_name = game.get('game_name') or 'Игра'
+        creator = game.get('creator_login') or game.get('creator_nickname') or 'Игрок'
+        mode_text = LOBBY_MODES.get(game.get('game_mode'), '')
+        prize_text = f" 🏆 {html.escape(game['prize'])}" if game.get('prize') else ''
+
+        text += f"{idx}. <b>{html.escape(game_name)}</b> — {mode_text}{prize_text}\n"
+        text += f"   автор: {html.escape(creator)}\n"
+
+        game_url = f"{WEBAPP_URL}?startapp=game_{game['id']}"
+        keyboard.append([
+            InlineKeyboardButton(f"▶️ {idx}. {game_name}", web_app=WebAppInfo(url=game_url))
+        ])
+
+    if stale:
+        text += STALE_NOTICE
+
+    # Фильтр по режиму игры (текущий отмечен точкой)
+    filter_labels = {'ALL': 'Все', 'NUMBERS': '🔢', 'WORDS': '📝', 'BATTLESHIP': '🚢'}
+    keyboard.append([
+        InlineKeyboardButton(
+            f"• {label}" if key == mode_key else label,
+            callback_data=f'lobby_{key}'
+        )
+        for key, label in filter_labels.items()
+    ])
+
+    nav_row = []
+    if cursor:
+        nav_row.append(InlineKeyboardButton("⏮ В начало", callback_data=f'lobby_{mode_key}'))
+    if has_next:
+        nav_row.append(InlineKeyboardButton(
+            "Далее ▶️",
+            callback_data=f"lobby_{mode_key}_{encode_lobby_cursor(games[-1])}"
+        ))
+    if nav_row:
+        keyboard.append(nav_row)
+
+    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data='back_to_menu')])
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def lobby(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показать открытые игры (callback_data: lobby[_<MODE>[_<cursor>]])"""
+    query = update.callback_query
+    await query.answer()
+
+    if not supabase:
+        await query.message.reply_text("❌ База данных недоступна")
+        return
+
+    parts = query.data.split('_', 2)
+    mode_key = parts[1] if len(parts) > 1 else 'ALL'
+    game_mode = mode_key if mode_key in LOBBY_MODES else None
+    cursor = parts[2] if len(parts) > 2 else None
+
+    try:
+        text, reply_markup = await build_lobby_page(game_mode, cursor)
+        await query.message.edit_text(
+            text,
+            reply_markup=reply_markup,
+            parse_mode='HTML'
+        )
+    except BadRequest as e:
+        # Повторное нажатие на текущий фильтр — страница не изменилась
+        if 'not modified' not in str(e).lower():
+            logger.error(f"Ошибка при отображении лобби: {e}")
+    except DatabaseUnavailable as e:
+        logger.warning(f"БД недоступна при получении открытых игр: {e}")
+        await query.message.reply_text(DB_UNAVAILABLE_TEXT)
+    except Exception as e:
+        logger.error(f"Ошибка при получении открытых игр: {e}")
+        await query.message.reply_text("❌ Ошибка при загрузке открытых игр")
+
+
+async def lobby_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /lobby"""
+    if not supabase:
+        await update.message.reply_text("❌ База данных недоступна")
+        return
+
+    try:
+        text, reply_markup = await build_lobby_page(None, None)
+        await update.message.reply_text(
+            text,
+            reply_markup=reply_markup,
+            parse_mode='HTML'
+        )
+    except DatabaseUnavailable as e:
+        logger.warning(f"БД недоступна при получении открытых игр: {e}")
+        await update.message.reply_text(DB_UNAVAILABLE_TEXT)
+    except Exception as e:
+        logger.error(f"Ошибка при получении открытых игр: {e}")
+        await update.message.reply_text("❌ Ошибка при загрузке открытых игр")
+
+
+def player_matches(player: dict, prefix: str) -> bool:
+    """Проверить, начинается ли login или telegram_username игрока с префикса"""
+    return any(
+        (player.get(field) or '').lower().startswith(prefix)
+        for field in ('login', 'telegram_username')
+    )
+
+
+async def search_players(prefix: str) -> list:
+    """
+    Найти игроков по началу login или telegram_username
+
+    Поиск по БД использует trigram-индексы из supabase-migration-player-search.sql.
+    Пустой префикс возвращает последних онлайн игроков.
+
+    Args:
+        prefix: нормализованный (в нижнем регистре) префикс
+
+    Returns:
+        Список игроков (не более SEARCH_RESULTS_LIMIT + 1: кэш общий, а
+        самого пользователя исключает inline_search)
+    """
+    now = time.monotonic()
+
+    for length in range(len(prefix), -1, -1):
+        cached = search_cache.get(prefix[:length])
+        if not cached or now - cached[0] >= SEARCH_CACHE_TTL:
+            continue
+        if length == len(prefix):
+            return cached[1]
+        # Короткий префикс дал неполный список — нужен запрос к БД
+        if length > 0 and cached[2]:
+            return [p for p in cached[1] if player_matches(p, prefix)]
+        break
+
+    # Одновременные промахи по одному префиксу ждут один и тот же запрос
+    async def load() -> list:
+        query = supabase.table('players')\
+            .select('id, login, nickname, telegram_id, telegram_username, telegram_first_name, is_online')
+
+        if prefix:
+            query = query.or_(f"login.ilike.{prefix}*,telegram_username.ilike.{prefix}*")
+        else:
+            query = query.eq('is_online', True)
+
+        result = await db_execute(
+            query
+            .order('is_online', desc=True)
+            .order('last_seen', desc=True)
+            .limit(SEARCH_RESULTS_LIMIT + 1),
+            fallback_key=('search', prefix)
+        )
+
+        # Полнота определяется по ответу БД до фильтрации: иначе ложные
+        # совпадения по '_' сделали бы неполный список «полным»
+        complete = len(result.data or []) <= SEARCH_RESULTS_LIMIT
+
+        # '_' в ILIKE означает любой символ — отсекаем ложные совпадения
+        rows = [p for p in (result.data or []) if not prefix or player_matches(p, prefix)]
+        if result.stale:
+            return rows
+
+        now = time.monotonic()
+        if len(search_cache) > 1000:
+            search_cache.clear()
+        search_cache[prefix] = (now, rows, complete)
+        return rows
+
+    return await single_flight(('search', prefix), load)
+
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Inline-поиск игроков для приглашения: @bot <логин>"""
+    inline_query = update.inline_query
+    user = update.effective_user
+
+    if not supabase:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME, is_personal=True)
+        return
+
+    # Оставляем только символы, допустимые в логинах и username
+    prefix = re.sub(r'[^\w.-]', '', inline_query.query.strip().lstrip('@')).lower()
+
+    try:
+        players = await search_players(prefix)
+    except Exception as e:
+        logger.error(f"Ошибка при поиске игроков: {e}")
+        await inline_query.answer([], cache_time=0, is_personal=True)
+        return
+
+    from_name = html.escape(user.first_name or user.username or 'Игрок')
+    play_url = f"https://t.me/{context.bot.username}?start=play"
+    results = []
+
+    # Себя пригласить нельзя, поэтому результаты персональные
+    players = [p for p in players if p.get('telegram_id') != user.id][:SEARCH_RESULTS_LIMIT]
+
+    for player in players:
+
+        name = player.get('telegram_first_name') or player.get('nickname') or player.get('login') or 'Игрок'
+        username = f"@{player['telegram_username']}" if player.get('telegram_username') else ''
+        status = "🟢 онлайн" if player.get('is_online') else "⚪ не в сети"
+        mention = username or html.escape(name)
+
+        results.append(InlineQueryResultArticle(
+            id=str(player['id']),
+            title=f"✉️ {name}",
+            description=f"{player.get('login') or ''} {username} · {status}".strip(),
+            input_message_content=InputTextMessageContent(
+                f"🎮 <b>{from_name}</b> приглашает {mention} сыграть в <b>\"Быки и Коровы\"</b>!",
+                parse_mode='HTML'
+            ),
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("🎮 Играть", url=play_url)
+            ]]),
+        ))
+
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показать помощь"""
     query = update.callback_query
@@ -267,8 +696,12 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 <b>Команды бота:</b>
 /start - Главное меню
 /participants - Список участников
+/lobby - Открытые игры
 /help - Эта справка
 
+<b>Поиск игроков:</b>
+Наберите в любом чате @имя_бота и логин игрока, чтобы пригласить его.
+
 <b>Как играть:</b>
 1. Нажмите "🎮 Играть"
 2. Создайте игру или присоединитесь к существующей
@@ -300,20 +733,26 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = update.callback_query
     data = query.data
 
-    if data == 'participants':
-        await participants(update, context)
-    elif data == 'my_invitations':
-        await my_invitations(update, context)
-    elif data == 'help':
-        await help_command(update, context)
-    elif data == 'back_to_menu':
-        await back_to_menu(update, context)
-    elif data.startswith('invite_'):
-        await send_invitation(update, context)
-    elif data.startswith('accept_'):
-        await accept_invitation(update, context)
-    elif data.startswith('reject_'):
-        await reject_invitation(update, context)
+    # Маршрут для профилирования: префикс для кнопок с параметрами
+    route = data.split('_', 1)[0] if data.startswith(('lobby_', 'invite_', 'accept_', 'reject_')) else data
+
+    with profiler.trace(route, data):
+        if data == 'participants':
+            await participants(update, context)
+        elif data == 'lobby' or data.startswith('lobby_'):
+            await lobby(update, context)
+        elif data == 'my_invitations':
+            await my_invitations(update, context)
+        elif data == 'help':
+            await help_command(update, context)
+        elif data == 'back_to_menu':
+            await back_to_menu(update, context)
+        elif data.startswith('invite_'):
+            await send_invitation(update, context)
+        elif data.startswith('accept_'):
+            await accept_invitation(update, context)
+        elif data.startswith('reject_'):
+            await reject_invitation(update, context)
 
 
 async def send_invitation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -333,13 +772,16 @@ async def accept_invitation(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     try:
         # Обновляем статус приглашения
-        supabase.table('invitations').update({
+        await db_execute(supabase_write.table('invitations').update({
             'status': 'ACCEPTED',
             'updated_at': datetime.now().isoformat()
-        }).eq('id', invitation_id).execute()
+        }).eq('id', invitation_id), 'write')
 
         await query.answer("✅ Приглашение принято!", show_alert=True)
         await my_invitations(update, context)
+    except DatabaseUnavailable as e:
+        logger.warning(f"БД недоступна при обновлении приглашения: {e}")
+        await query.answer(DB_UNAVAILABLE_TEXT, show_alert=True)
     except Exception as e:
         logger.error(f"Ошибка при принятии приглашения: {e}")
         await query.answer("❌ Ошибка", show_alert=True)
@@ -356,13 +798,16 @@ async def reject_invitation(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     try:
         # Обновляем статус приглашения
-        supabase.table('invitations').update({
+        await db_execute(supabase_write.table('invitations').update({
             'status': 'REJECTED',
             'updated_at': datetime.now().isoformat()
-        }).eq('id', invitation_id).execute()
+        }).eq('id', invitation_id), 'write')
 
         await query.answer("❌ Приглашение отклонено", show_alert=True)
         await my_invitations(update, context)
+    except DatabaseUnavailable as e:
+        logger.warning(f"БД недоступна при обновлении приглашения: {e}")
+        await query.answer(DB_UNAVAILABLE_TEXT, show_alert=True)
     except Exception as e:
         logger.error(f"Ошибка при отклонении приглашения: {e}")
         await query.answer("❌ Ошибка", show_alert=True)
@@ -376,6 +821,7 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     keyboard = [
         [InlineKeyboardButton("🎮 Играть", web_app=WebAppInfo(url=WEBAPP_URL))],
         [InlineKeyboardButton("👥 Участники", callback_data='participants')],
+        [InlineKeyboardButton("🎲 Открытые игры", callback_data='lobby')],
         [InlineKeyboardButton("📨 Мои приглашения", callback_data='my_invitations')],
         [InlineKeyboardButton("ℹ️ Помощь", callback_data='help')],
     ]
@@ -398,16 +844,65 @@ async def participants_command(update: Update, context: ContextTypes.DEFAULT_TYP
     await participants(update, context)
 
 
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /profile [секунды] - профилирование бота (только для администраторов)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Команда доступна только администраторам")
+        return
+
+    try:
+        duration = float(context.args[0]) if context.args else PROFILE_DURATION
+    except ValueError:
+        duration = None
+
+    if duration is None or not math.isfinite(duration) or duration <= 0:
+        await update.message.reply_text("Использование: /profile [секунды]")
+        return
+
+    chat_id = update.effective_chat.id
+
+    def send_report(report: str) -> None:
+        # Лимит сообщения Telegram - 4096 символов
+        context.application.create_task(context.bot.send_message(chat_id=chat_id, text=report[:4000]))
+
+    if not profiler.start(duration, on_finish=send_report):
+        await update.message.reply_text("📊 Профилирование уже запущено")
+        return
+
+    await update.message.reply_text(f"📊 Профилирование запущено на {profiler.duration:.0f} с, отчет придет сюда")
+
+
+async def slow_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /slow - самые медленные обновления последнего профилирования"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Команда доступна только администраторам")
+        return
+
+    await update.message.reply_text(profiler.slowest_report()[:4000])
+
+
 def main() -> None:
     """Запуск бота"""
     # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    # TimedRequest учитывает время запросов к Telegram API при профилировании.
+    # Размер пула как у запроса по умолчанию в ApplicationBuilder.
+    # Обновления обрабатываются параллельно: медленный запрос к БД одного
+    # пользователя не задерживает остальных
+    application = Application.builder()\
+        .token(BOT_TOKEN)\
+        .request(TimedRequest(connection_pool_size=256))\
+        .concurrent_updates(CONCURRENT_UPDATES)\
+        .build()
 
     # Регистрируем обработчики
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("participants", participants_command))
+    application.add_handler(CommandHandler("lobby", lobby_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("slow", slow_command))
     application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(InlineQueryHandler(inline_search))
 
     # Запускаем бота
     logger.info("Бот запущен!")
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Защита обращений к Supabase
+Бюджеты задержки, circuit breaker и последние удачные данные на время сбоя БД
+"""
+
+import os
+import time
+import asyncio
+import logging
+import httpx
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional
+
+from postgrest.exceptions import APIError
+
+from profiling import record
+
+logger = logging.getLogger(__name__)
+
+# Бюджет задержки (секунды) для каждого вида операции.
+# Для записи бюджет задает таймаут HTTP-клиента (см. DB_WRITE_CLIENT_TIMEOUT)
+DB_BUDGETS = {
+    'read': float(os.getenv("DB_READ_TIMEOUT", "3")),
+    'write': float(os.getenv("DB_WRITE_TIMEOUT", "5")),
+    'poll': float(os.getenv("DB_POLL_TIMEOUT", "5")),
+}
+
+# Таймаут HTTP-клиента Supabase для чтения: поток с запросом, брошенным
+# по бюджету, не будет висеть дольше самого большого бюджета на фазу
+DB_CLIENT_TIMEOUT = max(DB_BUDGETS['read'], DB_BUDGETS['poll'])
+
+# Таймаут HTTP-клиента для записи. httpx применяет таймаут к каждой фазе
+# запроса отдельно, поэтому бюджет делится между фазами и вся запись
+# укладывается в DB_WRITE_TIMEOUT
+DB_WRITE_CLIENT_TIMEOUT = httpx.Timeout(
+    connect=DB_BUDGETS['write'] * 0.3,
+    read=DB_BUDGETS['write'] * 0.5,
+    write=DB_BUDGETS['write'] * 0.1,
+    pool=DB_BUDGETS['write'] * 0.1,
+)
+
+# Circuit breaker: сколько сбоев подряд размыкают цепь и через сколько секунд
+# пропускается пробный запрос
+DB_CIRCUIT_FAILURES = int(os.getenv("DB_CIRCUIT_FAILURES", "5"))
+DB_CIRCUIT_RESET = float(os.getenv("DB_CIRCUIT_RESET", "30"))
+
+# Отдавать последние удачные данные, пока БД недоступна, и их максимальный возраст (секунды)
+DB_SERVE_STALE = os.getenv("DB_SERVE_STALE", "1") == "1"
+DB_STALE_MAX_AGE = float(os.getenv("DB_STALE_MAX_AGE", "600"))
+
+# Коды ошибок PostgREST, означающие перегрузку или недоступность БД:
+# PGRST000–PGRST003 — соединение, пул соединений, кэш схемы;
+# SQLSTATE классов 08 (соединение), 53 (ресурсы), 57 (в т.ч. 57014 — statement timeout)
+UNAVAILABLE_CODES = {'PGRST000', 'PGRST001', 'PGRST002', 'PGRST003'}
+UNAVAILABLE_SQLSTATE_CLASSES = ('08', '53', '57')
+
+
+class DatabaseUnavailable(Exception):
+    """БД не ответила в бюджет задержки или цепь разомкнута"""
+
+
+@dataclass
+class DBResult:
+    """Результат запроса; stale=True если это данные из кэша на время сбоя"""
+    data: Any
+    stale: bool = False
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для запросов к БД
+
+    После failure_threshold сбоев подряд цепь размыкается и запросы сразу
+    отклоняются. Через reset_timeout секунд пропускается один пробный запрос:
+    при успехе цепь замыкается, при сбое снова размыкается.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """Сколько секунд осталось до пробного запроса"""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("✅ БД снова доступна, цепь замкнута")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"⚠️ БД недоступна ({self.failures} сбоев подряд), цепь разомкнута")
+            self.opened_at = time.monotonic()
+
+
+def is_unavailable_error(error: APIError) -> bool:
+    """
+    Означает ли ошибка PostgREST сбой БД, а не ошибку самого запроса
+
+    Если тело ответа не JSON, postgrest-py кладет в code HTTP-статус,
+    поэтому 5xx тоже считаются сбоем.
+    """
+    code = str(error.code or '')
+    if code in UNAVAILABLE_CODES:
+        return True
+    if len(code) == 5 and code.startswith(UNAVAILABLE_SQLSTATE_CLASSES):
+        return True
+    return len(code) == 3 and code.isdigit() and code.startswith('5')
+
+
+breaker = CircuitBreaker(DB_CIRCUIT_FAILURES, DB_CIRCUIT_RESET)
+
+# Последние удачные данные: fallback_key -> (время загрузки, data)
+last_good: dict = {}
+
+
+def _stale_or_raise(fallback_key: Optional[Hashable], reason: str) -> DBResult:
+    """Вернуть последние удачные данные или поднять DatabaseUnavailable"""
+    if DB_SERVE_STALE and fallback_key is not None:
+        cached = last_good.get(fallback_key)
+        if cached and time.monotonic() - cached[0] < DB_STALE_MAX_AGE:
+            logger.warning(f"⚠️ {reason}, отдаем сохраненные данные: {fallback_key}")
+            return DBResult(cached[1], stale=True)
+    raise DatabaseUnavailable(reason)
+
+
+async def db_execute(query, operation: str = 'read', fallback_key: Optional[Hashable] = None) -> DBResult:
+    """
+    Выполнить запрос Supabase с бюджетом задержки через circuit breaker
+
+    Синхронный .execute() выполняется в отдельном потоке, чтобы медленная БД
+    не блокировала event loop. Ошибки PostgREST о перегрузке БД (таймаут
+    запроса, пул соединений, 5xx) считаются сбоем, остальные ответы с ошибкой
+    (например, PGRST116 от .single()) означают, что БД доступна.
+
+    Запись не прерывается по бюджету: брошенный поток мог бы выполнить ее уже
+    после ответа пользователю об ошибке. Ее длительность ограничивает таймаут
+    клиента записи (DB_WRITE_CLIENT_TIMEOUT), поэтому запрос на запись нужно
+    строить от клиента, созданного с этим таймаутом. Даже при таймауте клиента
+    сервер мог успеть применить запись, поэтому такой сбой означает
+    «результат неизвестен», а не «запись не выполнена».
+
+    Args:
+        query: построенный запрос (table(...)..., rpc(...)) без .execute()
+        operation: вид операции из DB_BUDGETS (read, write, poll)
+        fallback_key: ключ для сохранения и выдачи последних удачных данных
+
+    Returns:
+        DBResult с данными запроса
+
+    Raises:
+        DatabaseUnavailable: БД не ответила вовремя или цепь разомкнута,
+            а сохраненных данных нет
+    """
+    probe = breaker.state == 'half_open'
+    if not breaker.allow():
+        return _stale_or_raise(fallback_key, f"цепь разомкнута, повтор через {breaker.retry_after():.0f} с")
+
+    budget = DB_BUDGETS[operation]
+    started = time.perf_counter()
+    try:
+        if operation == 'write':
+            result = await asyncio.to_thread(query.execute)
+        else:
+            result = await asyncio.wait_for(asyncio.to_thread(query.execute), timeout=budget)
+    except asyncio.CancelledError:
+        # Отмененный пробный запрос не должен навсегда занять слот пробы
+        if probe:
+            breaker.probing = False
+        raise
+    except APIError as e:
+        if not is_unavailable_error(e):
+            breaker.record_success()
+            raise
+        breaker.record_failure()
+        logger.error(f"БД перегружена или недоступна: {e.code} {e.message}")
+        return _stale_or_raise(fallback_key, f"ошибка БД {e.code} в запросе {operation}")
+    except asyncio.TimeoutError:
+        breaker.record_failure()
+        return _stale_or_raise(fallback_key, f"запрос {operation} превысил бюджет {budget} с")
+    except Exception as e:
+        breaker.record_failure()
+        logger.error(f"Ошибка соединения с БД: {e}")
+        return _stale_or_raise(fallback_key, f"ошибка запроса {operation}")
+    finally:
+        record('db', time.perf_counter() - started)
+
+    breaker.record_success()
+    if fallback_key is not None:
+        now = time.monotonic()
+        if len(last_good) > 1000:
+            for stale_key in [k for k, (saved_at, _) in last_good.items() if now - saved_at >= DB_STALE_MAX_AGE]:
+                del last_good[stale_key]
+        last_good[fallback_key] = (now, result.data)
+    return DBResult(result.data)
@@ -5,13 +5,18 @@
 """
 
 import os
+import signal
 import asyncio
 import logging
 from datetime import datetime
 from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
 from dotenv import load_dotenv
 
+from db_guard import DB_CLIENT_TIMEOUT, DatabaseUnavailable, breaker, db_execute
+from profiling import PROFILE_DURATION, TimedRequest, profiler
+
 load_dotenv()
 
 logging.basicConfig(
@@ -27,8 +32,15 @@ SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
 
 # Инициализация
-bot = Bot(token=BOT_TOKEN)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
+bot = Bot(token=BOT_TOKEN, request=TimedRequest())
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    options=ClientOptions(postgrest_client_timeout=DB_CLIENT_TIMEOUT)
+) if SUPABASE_URL and SUPABASE_KEY else None
+
+# Интервал опроса приглашений (секунды)
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "3"))
 
 # Кэш обработанных приглашений
 processed_invitations = set()
@@ -44,33 +56,36 @@ async def send_invitation_notification(invitation: dict) -> bool:
             return True
 
         # Получаем данные отправителя
-        from_player = supabase.table('players')\
-            .select('*')\
-            .eq('id', invitation['from_player_id'])\
-            .single()\
-            .execute()
+        from_player = await db_execute(
+            supabase.table('players')
+            .select('*')
+            .eq('id', invitation['from_player_id'])
+            .single()
+        )
 
         if not from_player.data:
             logger.error(f"Отправитель не найден: {invitation['from_player_id']}")
             return False
 
         # Получаем данные получателя
-        to_player = supabase.table('players')\
-            .select('*')\
-            .eq('id', invitation['to_player_id'])\
-            .single()\
-            .execute()
+        to_player = await db_execute(
+            supabase.table('players')
+            .select('*')
+            .eq('id', invitation['to_player_id'])
+            .single()
+        )
 
         if not to_player.data or not to_player.data.get('telegram_id'):
             logger.error(f"Получатель не найден или нет telegram_id: {invitation['to_player_id']}")
             return False
 
         # Получаем данные игры
-        game = supabase.table('games')\
-            .select('*')\
-            .eq('id', invitation['game_id'])\
-            .single()\
-            .execute()
+        game = await db_execute(
+            supabase.table('games')
+            .select('*')
+            .eq('id', invitation['game_id'])
+            .single()
+        )
 
         if not game.data:
             logger.error(f"Игра не найдена: {invitation['game_id']}")
@@ -115,6 +130,9 @@ async def send_invitation_notification(invitation: dict) -> bool:
 
         return True
 
+    except DatabaseUnavailable as e:
+        logger.warning(f"⏳ БД недоступна, уведомление отложено: {e}")
+        return False
     except Exception as e:
         logger.error(f"❌ Ошибка при отправке уведомления: {e}")
         return False
@@ -124,28 +142,40 @@ async def check_new_invitations():
     """Проверить новые приглашения каждые N секунд"""
     logger.info("🔄 Запуск слушателя приглашений...")
 
+    # kill -USR1 <pid> запускает профилирование, отчет пишется в лог
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, profiler.start, PROFILE_DURATION)
+
     while True:
-        try:
-            # Получаем все PENDING приглашения
-            result = supabase.table('invitations')\
-                .select('*')\
-                .eq('status', 'PENDING')\
-                .execute()
-
-            if result.data:
-                for invitation in result.data:
-                    await send_invitation_notification(invitation)
-
-            # Очищаем кэш старых приглашений (старше 1 часа)
-            if len(processed_invitations) > 1000:
-                processed_invitations.clear()
-                logger.info("🗑️ Очищен кэш приглашений")
-
-        except Exception as e:
-            logger.error(f"❌ Ошибка при проверке приглашений: {e}")
-
-        # Проверяем каждые 3 секунды
-        await asyncio.sleep(3)
+        with profiler.trace('poll'):
+            try:
+                # Получаем все PENDING приглашения
+                result = await db_execute(
+                    supabase.table('invitations')
+                    .select('*')
+                    .eq('status', 'PENDING'),
+                    'poll'
+                )
+
+                if result.data:
+                    for invitation in result.data:
+                        # Цепь разомкнулась — остальные приглашения дождутся следующего опроса
+                        if breaker.state != 'closed':
+                            break
+                        await send_invitation_notification(invitation)
+
+                # Очищаем кэш старых приглашений (старше 1 часа)
+                if len(processed_invitations) > 1000:
+                    processed_invitations.clear()
+                    logger.info("🗑️ Очищен кэш приглашений")
+
+            except DatabaseUnavailable as e:
+                logger.warning(f"⏳ БД недоступна, опрос приглашений пропущен: {e}")
+            except Exception as e:
+                logger.error(f"❌ Ошибка при проверке приглашений: {e}")
+
+        # Проверяем каждые POLL_INTERVAL секунд, а пока цепь разомкнута —
+        # не раньше пробного запроса
+        await asyncio.sleep(max(POLL_INTERVAL, breaker.retry_after()))
 
 
 def main():
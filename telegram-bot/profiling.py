@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Профилирование бота и слушателя по запросу администратора
+Сэмплирующий профайлер и трассировка обновлений: время в БД, Telegram API и своем коде
+"""
+
+import os
+import sys
+import time
+import heapq
+import asyncio
+import logging
+import threading
+import contextlib
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Optional
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Длительность окна профилирования по умолчанию и максимальная (секунды)
+PROFILE_DURATION = float(os.getenv("PROFILE_DURATION", "30"))
+PROFILE_MAX_DURATION = float(os.getenv("PROFILE_MAX_DURATION", "300"))
+# Интервал сэмплирования стека (секунды)
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+# Сколько самых медленных обновлений хранить
+PROFILE_SLOWEST_N = int(os.getenv("PROFILE_SLOWEST_N", "20"))
+
+# Трассировка текущего обновления (None, если профилирование выключено)
+_current_trace: ContextVar = ContextVar('current_trace', default=None)
+
+
+def record(kind: str, seconds: float) -> None:
+    """Учесть время внешнего вызова (db или telegram) в текущей трассировке"""
+    trace = _current_trace.get()
+    if trace is not None:
+        setattr(trace, kind, getattr(trace, kind) + seconds)
+
+
+class _Trace:
+    """Трассировка одного обновления или тика опроса"""
+
+    def __init__(self, profiler: 'Profiler', route: str, detail: str):
+        self.profiler = profiler
+        self.route = route
+        self.detail = detail
+        self.db = 0.0
+        self.telegram = 0.0
+
+    def __enter__(self) -> '_Trace':
+        self.token = _current_trace.set(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        total = time.perf_counter() - self.started
+        _current_trace.reset(self.token)
+        self.profiler._add_trace(self, total)
+
+
+class Profiler:
+    """
+    Профилирование за ограниченное окно времени
+
+    Пока окно открыто, отдельный поток сэмплирует стек потока event loop,
+    а trace() собирает по маршрутам время в БД, Telegram API и локальной
+    работе. Самые медленные обновления сохраняются и после закрытия окна.
+    Вне окна trace() возвращает пустой контекстный менеджер.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.slowest: list = []
+        self._reset()
+
+    def _reset(self) -> None:
+        self.started_at: Optional[datetime] = None
+        self.duration = 0.0
+        self.samples = 0
+        self.idle_samples = 0
+        self.self_counts: Counter = Counter()
+        self.total_counts: Counter = Counter()
+        self.routes: dict = {}
+        self._seq = 0
+
+    def start(self, duration: float, on_finish: Optional[Callable[[str], None]] = None) -> bool:
+        """
+        Открыть окно профилирования
+
+        Вызывается из потока event loop. По окончании окна on_finish
+        получает текстовый отчет (также вызывается в event loop).
+
+        Returns:
+            False, если окно уже открыто
+        """
+        if self.active:
+            return False
+
+        self._reset()
+        self.slowest = []
+        self.duration = min(duration, PROFILE_MAX_DURATION)
+        self.started_at = datetime.now()
+        self.active = True
+
+        loop = asyncio.get_running_loop()
+        thread = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident(), loop, on_finish),
+            name='profiler',
+            daemon=True,
+        )
+        thread.start()
+        logger.info(f"📊 Профилирование запущено на {self.duration:.0f} с")
+        return True
+
+    def _sample(self, thread_id: int, loop: asyncio.AbstractEventLoop, on_finish) -> None:
+        """Сэмплировать стек потока thread_id до конца окна"""
+        deadline = time.monotonic() + self.duration
+        self_counts = Counter()
+        total_counts = Counter()
+        samples = 0
+        idle_samples = 0
+
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None and self._is_idle(frame):
+                # Event loop ждет событий в селекторе — это простой, а не работа
+                idle_samples += 1
+            elif frame is not None:
+                samples += 1
+                self_counts[self._frame_key(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    key = self._frame_key(frame)
+                    if key not in seen:
+                        seen.add(key)
+                        total_counts[key] += 1
+                    frame = frame.f_back
+            time.sleep(PROFILE_SAMPLE_INTERVAL)
+
+        loop.call_soon_threadsafe(self._finish, samples, idle_samples, self_counts, total_counts, on_finish)
+
+    @staticmethod
+    def _is_idle(frame) -> bool:
+        code = frame.f_code
+        return code.co_name == 'select' and os.path.basename(code.co_filename) == 'selectors.py'
+
+    @staticmethod
+    def _frame_key(frame) -> str:
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+
+    def _finish(self, samples: int, idle_samples: int, self_counts: Counter, total_counts: Counter,
+                on_finish) -> None:
+        self.active = False
+        self.samples = samples
+        self.idle_samples = idle_samples
+        self.self_counts = self_counts
+        self.total_counts = total_counts
+
+        report = self.report()
+        logger.info(report)
+        if on_finish:
+            on_finish(report)
+
+    def trace(self, route: str, detail: str = ''):
+        """Контекстный менеджер трассировки обновления по маршруту route"""
+        if not self.active:
+            return contextlib.nullcontext()
+        return _Trace(self, route, detail)
+
+    def _add_trace(self, trace: _Trace, total: float) -> None:
+        if not self.active:
+            return
+
+        local = max(0.0, total - trace.db - trace.telegram)
+        stats = self.routes.setdefault(trace.route, [0, 0.0, 0.0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += total
+        stats[2] += trace.db
+        stats[3] += trace.telegram
+        stats[4] += local
+
+        # Мин-куча: на вершине самое быстрое из сохраненных обновлений
+        self._seq += 1
+        entry = (total, self._seq, {
+            'at': datetime.now().strftime('%H:%M:%S'),
+            'route': trace.route,
+            'detail': trace.detail,
+            'db': trace.db,
+            'telegram': trace.telegram,
+            'local': local,
+        })
+        if len(self.slowest) < PROFILE_SLOWEST_N:
+            heapq.heappush(self.slowest, entry)
+        elif total > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def slowest_report(self) -> str:
+        """Текстовый список самых медленных обновлений"""
+        if not self.slowest:
+            return "Нет данных о медленных обновлениях"
+
+        lines = [f"🐢 Самые медленные обновления ({len(self.slowest)}):"]
+        for idx, (total, _, item) in enumerate(sorted(self.slowest, reverse=True), 1):
+            detail = f" {item['detail']}" if item['detail'] else ''
+            lines.append(
+                f"{idx}. {item['at']} {item['route']}{detail}: {total * 1000:.0f} мс "
+                f"(БД {item['db'] * 1000:.0f}, TG {item['telegram'] * 1000:.0f}, "
+                f"код {item['local'] * 1000:.0f})"
+            )
+        return "\n".join(lines)
+
+    def report(self, top: int = 10) -> str:
+        """Текстовый отчет по окну профилирования"""
+        started = self.started_at.strftime('%H:%M:%S') if self.started_at else '—'
+        lines = [
+            f"📊 Профиль с {started} за {self.duration:.0f} с "
+            f"({self.samples} сэмплов работы, {self.idle_samples} простоя)",
+            "",
+        ]
+
+        lines.append("Маршруты: кол-во, среднее мс (БД / TG / код)")
+        if not self.routes:
+            lines.append("—")
+        for route, (count, total, db, telegram, local) in sorted(
+                self.routes.items(), key=lambda item: item[1][1], reverse=True):
+            lines.append(
+                f"{route}: {count}, {total / count * 1000:.0f} "
+                f"({db / count * 1000:.0f} / {telegram / count * 1000:.0f} / {local / count * 1000:.0f})"
+            )
+
+        if self.samples:
+            # Доли считаются только от сэмплов работы, простой event loop не учитывается
+            lines += ["", "Собственное время (доля сэмплов работы):"]
+            for key, count in self.self_counts.most_common(top):
+                lines.append(f"{count / self.samples:6.1%} {key}")
+            lines += ["", "Общее время (доля сэмплов работы):"]
+            for key, count in self.total_counts.most_common(top):
+                lines.append(f"{count / self.samples:6.1%} {key}")
+
+        lines += ["", self.slowest_report()]
+        return "\n".join(lines)
+
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest, учитывающий время запросов к Telegram API в трассировке"""
+
+    async def do_request(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            record('telegram', time.perf_counter() - started)
+
+
+profiler = Profiler()
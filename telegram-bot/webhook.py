@@ -9,8 +9,11 @@ import logging
 from typing import Optional
 from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
 from dotenv import load_dotenv
 
+from db_guard import DB_CLIENT_TIMEOUT, DatabaseUnavailable, db_execute
+
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
@@ -24,7 +27,11 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
 
 # Инициализация
 bot = Bot(token=BOT_TOKEN)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    options=ClientOptions(postgrest_client_timeout=DB_CLIENT_TIMEOUT)
+) if SUPABASE_URL and SUPABASE_KEY else None
 
 
 async def send_game_invitation_notification(
@@ -51,33 +58,36 @@ async def send_game_invitation_notification(
 
     try:
         # Получаем данные отправителя
-        from_player = supabase.table('players')\
-            .select('login, telegram_first_name, telegram_id')\
-            .eq('id', from_player_id)\
-            .single()\
-            .execute()
+        from_player = await db_execute(
+            supabase.table('players')
+            .select('login, telegram_first_name, telegram_id')
+            .eq('id', from_player_id)
+            .single()
+        )
 
         if not from_player.data:
             logger.error(f"Отправитель {from_player_id} не найден")
             return False
 
         # Получаем данные получателя
-        to_player = supabase.table('players')\
-            .select('telegram_id')\
-            .eq('id', to_player_id)\
-            .single()\
-            .execute()
+        to_player = await db_execute(
+            supabase.table('players')
+            .select('telegram_id')
+            .eq('id', to_player_id)
+            .single()
+        )
 
         if not to_player.data or not to_player.data.get('telegram_id'):
             logger.error(f"Получатель {to_player_id} не найден или нет telegram_id")
             return False
 
         # Получаем данные игры
-        game = supabase.table('games')\
-            .select('game_name, game_mode, prize')\
-            .eq('id', game_id)\
-            .single()\
-            .execute()
+        game = await db_execute(
+            supabase.table('games')
+            .select('game_name, game_mode, prize')
+            .eq('id', game_id)
+            .single()
+        )
 
         if not game.data:
             logger.error(f"Игра {game_id} не найдена")
@@ -118,6 +128,9 @@ async def send_game_invitation_notification(
         logger.info(f"Уведомление отправлено: {to_player.data['telegram_id']}")
         return True
 
+    except DatabaseUnavailable as e:
+        logger.warning(f"БД недоступна, уведомление не отправлено: {e}")
+        return False
     except Exception as e:
         logger.error(f"Ошибка при отправке уведомления: {e}")
         return False